@@ -1,10 +1,10 @@
 """Configuration variables made easy!"""
 import itertools as _itertools
 
-from .api import load, hold, _held_vars
+from .api import load, hold, store_many, validate, memory_report, _held_vars
 
 
-__all__ = ["load", "hold"]
+__all__ = ["load", "hold", "store_many", "validate", "memory_report"]
 
 
 def __getattr__(name):
@@ -1,8 +1,12 @@
 """API functions for loading variables in modules/scripts."""
-from .storage import _load_vars, VarNotFound, SETTINGS
+import collections
+import sys
 
+from .storage import (_load_vars, _store_many_vars, _referenced_objects, _loaded_vars,
+                      _LazyAttrFrozenDict, _LazyVar, VarNotFound, SETTINGS)
 
-def load(name, vars_=None, settings=SETTINGS):
+
+def load(name, vars_=None, settings=SETTINGS, lazy=False):
     """Load the variables associated with 'name'.
 
     Parameters
@@ -21,6 +25,14 @@ def load(name, vars_=None, settings=SETTINGS):
     settings: mapping (default .storage.SETTINGS)
         a mapping containing the necessary settings (see .storage._SETTINGS),
         usually doesn't need to be set to a value other than the default
+    lazy: bool (default False)
+        wether or not to defer reading the file until the variables are first
+        accessed, in which case errors are raised on first access (see validate)
+        if vars_ is:
+            - None: return the variables as an _LazyAttrFrozenDict object
+            - True or "all": not supported since the variable names are unknown
+            - a list of variable names as strings: the decorator sets descriptors
+                which load the variables on first access as class attributes
 
     Returns
     -------
@@ -35,7 +47,23 @@ def load(name, vars_=None, settings=SETTINGS):
     .storage.VarNotFound
         if vars_ is a list of variable names and one of its items is not
         an available variable for the given 'name'
+    ValueError
+        if lazy is True and vars_ is True or "all"
     """
+    if lazy:
+        if vars_ in ("all", True):
+            raise ValueError("lazy loading requires vars_ to be None or a list of variable names")
+        lazy_vars_ = _LazyAttrFrozenDict(name, settings=settings)
+        if vars_ is None:
+            return lazy_vars_
+
+        def lazy_load_decorator(cls):
+            for var in vars_:
+                setattr(cls, var, _LazyVar(lazy_vars_, var, cls))
+            return cls
+
+        return lazy_load_decorator
+
     if vars_ is None:
         return _load_vars(name, settings=settings)
 
@@ -57,6 +85,80 @@ def load(name, vars_=None, settings=SETTINGS):
     return load_decorator
 
 
+def validate(obj):
+    """Load the variables of 'obj' now if they were loaded with lazy=True.
+
+    Useful in tests to surface missing names or variables early.
+
+    Parameters
+    ----------
+    obj: .storage._LazyAttrFrozenDict or class
+        the variables returned by load(name, lazy=True), or a class
+        decorated with load(name, vars_, lazy=True) or one of its subclasses
+        (the variables of every decorated class in its mro are loaded)
+
+    Raises
+    ------
+    .storage.NameNotFound
+        if the file associated with the variables' name was not found
+    .storage.VarNotFound
+        if one of the variables set on the decorated class is not available
+    """
+    if isinstance(obj, _LazyAttrFrozenDict):
+        obj._load()
+        return
+    for cls in obj.__mro__:
+        for value in list(vars(cls).values()):
+            if isinstance(value, _LazyVar):
+                # call the descriptor directly, the variable may be overridden in a subclass
+                value.__get__(None, cls)
+
+
+MemoryUsage = collections.namedtuple("MemoryUsage", "total unique")
+
+
+def memory_report(vars_by_name=None):
+    """Return the memory used by loaded variables, and how much of it is shared between names.
+
+    Sizes are computed with sys.getsizeof over the dicts, keys and values
+    (nested dicts and lists included) referenced by each variables object.
+    Objects are shared between names when the variables were loaded with the
+    'dedup' setting (see .storage._SETTINGS), or when they are shared by the
+    interpreter (e.g. small ints).
+
+    Parameters
+    ----------
+    vars_by_name: mapping or None (default None)
+        a mapping of names to the variables loaded for them (as returned by
+        load, lazily loaded variables which weren't loaded yet use no memory)
+        if None, the variables loaded by this process which are still
+        referenced are reported (for names loaded several times, only the
+        most recently loaded variables are)
+
+    Returns
+    -------
+    report: dict
+        a dict mapping each name to a MemoryUsage(total, unique) named tuple:
+            - total: the bytes referenced by the variables, i.e. what they
+                would use if nothing were shared
+            - unique: the bytes referenced by these variables only, i.e. what
+                unloading them would free
+        total - unique is the number of bytes shared with the other names.
+        The bytes used by all the names together are the sum of the unique
+        bytes plus the bytes of the shared objects, counted once.
+    """
+    if vars_by_name is None:
+        vars_by_name = dict(_loaded_vars)  # strong references, so that nothing is collected while measuring
+    objects_by_name = {name: _referenced_objects(vars_) for name, vars_ in vars_by_name.items()}
+    counts = collections.Counter(obj_id for objects in objects_by_name.values() for obj_id in objects)
+    report = {}
+    for name, objects in objects_by_name.items():
+        sizes = {obj_id: sys.getsizeof(obj) for obj_id, obj in objects.items()}
+        report[name] = MemoryUsage(sum(sizes.values()),
+                                   sum(size for obj_id, size in sizes.items() if counts[obj_id] == 1))
+    return report
+
+
 _held_vars = []  # NOTE: mutable type to prevent import-related problems
 
 
@@ -80,3 +182,23 @@ def hold(name, reset=False, settings=SETTINGS):
         _held_vars[:] = [vars_]
     else:
         _held_vars.insert(0, vars_)
+
+
+def store_many(vars_by_name, settings=SETTINGS):
+    """Store the variables for several names, flushing them to disk together.
+
+    Each file is replaced atomically: readers see either its previous or its
+    new contents, never a partially written file. Files are replaced one after
+    the other, so readers may see some names updated and others not. If an
+    error is raised, the files already replaced are restored (this doesn't
+    cover crashes, see .storage._store_many_vars).
+
+    Parameters
+    ----------
+    vars_by_name: mapping
+        a mapping of names to dictionaries of json-encodable variables to store
+    settings: mapping (default .storage.SETTINGS)
+        a mapping containing the necessary settings (see .storage._SETTINGS),
+        usually doesn't need to be set to a value other than the default
+    """
+    _store_many_vars(vars_by_name, settings=settings)
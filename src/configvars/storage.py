@@ -1,19 +1,41 @@
 """A collection of storage-related classes, functions and variables."""
 from collections import abc
+import contextlib
+import hashlib
 import json
+import mmap
 import os
+import re
+import shutil
+import sys
+import tempfile
 import types
+import weakref
 from importlib import import_module  # to get the absolute path to the package
 
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
 
 _SETTINGS = {
     # TODO: better way to get 'store' directory path ?
     "storage_dir": os.path.join(import_module(__package__).__spec__.origin.rstrip("__init__.py"), "store"),
     "file_name": "{name}.json",  # no forward slash here
+    "blob_dir": "{name}.blobs",  # sidecar directory for large values, relative to 'storage_dir'
+    "blob_threshold": None,  # size in bytes above which values are moved to sidecar files (None: never)
+    "dedup": False,  # intern keys and str values (in lists too) to share them across loaded names
 }
 
+_BLOB_KEY = "__configvars_blob__"
+_BLOB_NAME = re.compile(r"[0-9a-f]{64}")  # sha256 hex digest of the sidecar file's contents
+
 SETTINGS = types.MappingProxyType(_SETTINGS)
 
+# the variables most recently loaded for each name, as long as they are referenced elsewhere
+_loaded_vars = weakref.WeakValueDictionary()
+
 
 class NameNotFound(Exception):
     """The given name did not match an existing file."""
@@ -49,6 +71,71 @@ def _frozen(msg=None):
     return frozen_method
 
 
+class _Blob:
+    """A value stored in a sidecar file, read on first access.
+
+    NOTES
+    -----
+    The file is only opened and mapped in memory when self.view is first
+    accessed. If the store was rewritten and the sidecar file removed in the
+    meantime, the variable is read again from the rewritten store, so the
+    value is the one stored at the time of first access.
+    The value is a memoryview of bytes: it compares equal to bytes-like
+    objects, but not to str.
+    """
+
+    def __init__(self, path, name, key, settings):
+        """Initialize self.
+
+        Parameters
+        ----------
+        path: str
+            the path to the sidecar file
+        name: str
+            the name associated with the file storing the variables
+        key: str
+            the name of the variable stored in the sidecar file
+        settings: mapping
+            a mapping containing the necessary settings
+        """
+        self.path = path
+        self.name = name
+        self.key = key
+        self.settings = settings
+        self._view = None
+
+    @property
+    def view(self):
+        """Return the contents of the sidecar file as a read-only memoryview.
+
+        Raises
+        ------
+        KeyError
+            if the sidecar file was removed by a rewrite of the store which
+            removed the variable too
+        """
+        if self._view is None:
+            try:
+                fd = os.open(self.path, os.O_RDONLY)
+            except FileNotFoundError:
+                # the store was rewritten and this sidecar file removed since it was loaded
+                self._view = _load_vars(self.name, settings=self.settings)[self.key]
+            else:
+                try:
+                    self._view = memoryview(mmap.mmap(fd, 0, access=mmap.ACCESS_READ))
+                finally:
+                    os.close(fd)  # the mapping holds its own reference to the file
+        return self._view
+
+    def __eq__(self, other):
+        if isinstance(other, _Blob):
+            other = other.view
+        return self.view == other
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({repr(self.path)})"
+
+
 # TODO: enforce str type keys (case-sensitivity?) and json-saveable objects
 # TODO: implement __contains__ ?
 class _AttrFrozenDict:
@@ -59,6 +146,8 @@ class _AttrFrozenDict:
     Supports obj.name and obj["name"] access (delete or assignment
     operations will raise a storage.FrozenError).
     Implements __iter__ and __eq__.
+    Values stored in sidecar files (see _store_vars) are returned as
+    read-only memoryviews, mapped in memory on first access.
     The internal dict (self._data) is modifiable, but should
     not be modified externaly (obviously).
 
@@ -108,7 +197,10 @@ class _AttrFrozenDict:
         KeyError
             if 'name' is not a key of self._data
         """
-        return self._data[name]
+        value = self._data[name]
+        if isinstance(value, _Blob):
+            return value.view
+        return value
 
     def __getattr__(self, name):
         """Get self._data item via attribute access.
@@ -118,7 +210,10 @@ class _AttrFrozenDict:
         KeyError
             if 'name' is not a key of self._data
         """
-        return self._data[name]
+        value = self._data[name]
+        if isinstance(value, _Blob):
+            return value.view
+        return value
 
     def __eq__(self, other):
         """Return wether 'self' and 'other' can be considered equal.
@@ -137,6 +232,8 @@ class _AttrFrozenDict:
         """
         if isinstance(other, abc.MutableMapping):
             return self._data == other
+        if isinstance(other, _LazyAttrFrozenDict):
+            other = other._load()
         try:
             return self._data == other._data
         except AttributeError as e:
@@ -151,6 +248,124 @@ class _AttrFrozenDict:
         return f"{self.__class__.__name__}({repr(self._data)})"
 
 
+class _LazyAttrFrozenDict:
+    """A read-only dict whose variables are only loaded on first access.
+
+    NOTES
+    -----
+    Supports the same operations as _AttrFrozenDict. The file for 'name'
+    is read (and storage.NameNotFound raised) on the first operation
+    which needs the variables, not on initialization.
+    """
+    __setattr__ = _frozen("cannot set attribute")
+    __setitem__ = _frozen("cannot set item")
+    __delattr__ = _frozen("cannot delete attribute")
+    __delitem__ = _frozen("cannot delete item")
+
+    def __init__(self, name, settings):
+        """Initialize self.
+
+        Parameters
+        ----------
+        name: str
+            the name associated with the file storing the variables
+        settings: mapping
+            a mapping containing the necessary settings
+        """
+        # modify self.__dict__ directly to avoid calling __setattr__ (which is frozen)
+        self.__dict__.update(_name=name, _settings=settings, _vars=None)
+
+    def _load(self):
+        """Load the variables if they haven't been loaded yet and return them.
+
+        Raises
+        ------
+        .storage.NameNotFound
+            if the file associated wih self._name was not found
+        """
+        if self._vars is None:
+            self.__dict__["_vars"] = _load_vars(self._name, settings=self._settings)
+        return self._vars
+
+    def __getitem__(self, name):
+        """Get the variable 'name' via subscript, loading the variables if needed."""
+        return self._load()[name]
+
+    def __getattr__(self, name):
+        """Get the variable 'name' via attribute access, loading the variables if needed.
+
+        Raises
+        ------
+        AttributeError
+            if 'name' is a dunder name, so that protocol lookups (copy, pickle...)
+            don't load the variables
+        KeyError
+            if 'name' is not an available variable
+        """
+        if name.startswith("__") and name.endswith("__"):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        return self._load()[name]
+
+    def __eq__(self, other):
+        """Return wether 'self' and 'other' can be considered equal (see _AttrFrozenDict.__eq__)."""
+        if isinstance(other, _LazyAttrFrozenDict):
+            other = other._load()
+        return self._load() == other
+
+    def __iter__(self):
+        """Return a dict key iterator object."""
+        return iter(self._load())
+
+    def __repr__(self):
+        if self._vars is None:
+            return f"{self.__class__.__name__}({repr(self._name)})"
+        return f"{self.__class__.__name__}({repr(self._vars._data)})"
+
+
+class _LazyVar:
+    """A class attribute descriptor loading a variable on first access.
+
+    NOTES
+    -----
+    On first access, the descriptor replaces itself on 'owner' with the
+    loaded value, so that later accesses are plain attribute lookups.
+    """
+
+    def __init__(self, vars_, var, owner):
+        """Initialize self.
+
+        Parameters
+        ----------
+        vars_: .storage._LazyAttrFrozenDict
+            the variables 'var' is loaded from
+        var: str
+            the name of the variable
+        owner: type
+            the class the descriptor is set on
+        """
+        self.vars_ = vars_
+        self.var = var
+        self.owner = owner
+
+    def __get__(self, obj, objtype=None):
+        """Load the variable and replace self by its value on self.owner.
+
+        Raises
+        ------
+        .storage.NameNotFound
+            if the file associated wih the variables' name was not found
+        .storage.VarNotFound
+            if self.var is not an available variable
+        """
+        try:
+            value = self.vars_[self.var]
+        except KeyError:
+            raise VarNotFound(f"variable '{self.var}' was not "
+                              f"found in '{self.vars_._name}'") from None
+        setattr(self.owner, self.var, value)
+        return value
+
+
 def _get_storage_location(name, settings):
     """Return the path to the file associated with 'name' as a string.
 
@@ -164,22 +379,409 @@ def _get_storage_location(name, settings):
     return os.path.join(settings["storage_dir"], settings["file_name"]).format(name=name)
 
 
+def _get_blob_location(name, settings):
+    """Return the path to the sidecar directory associated with 'name' as a string.
+
+    Parameters
+    ----------
+    name: str
+        the name associated with the file storing the variables
+    settings: mapping
+        a mapping containing the necessary settings
+    """
+    blob_dir = settings.get("blob_dir", _SETTINGS["blob_dir"])
+    return os.path.join(settings["storage_dir"], blob_dir).format(name=name)
+
+
+def _store_blobs(name, vars_, settings):
+    """Move the values of 'vars_' above the size threshold to sidecar files.
+
+    Sidecar files are named after the hash of their contents and are never
+    rewritten, so that values loaded by a previous _load_vars stay valid.
+
+    Parameters
+    ----------
+    name: str
+        the name associated with the file storing the variables
+    vars_: dict
+        a dictionary of key/value pairs to store
+    settings: mapping
+        a mapping containing the necessary settings
+
+    Raises
+    ------
+    ValueError
+        if a value is a dict containing the key reserved for sidecar file references
+
+    Returns
+    -------
+    stored_vars: dict
+        a copy of 'vars_' where the values stored in sidecar files are
+        replaced by json-encodable references to these files
+    blob_names: set
+        the names of the sidecar files referenced by 'stored_vars'
+    created: list
+        the paths of the sidecar files created by this call
+    """
+    threshold = settings.get("blob_threshold")
+    blob_loc = _get_blob_location(name, settings=settings)
+    stored_vars = {}
+    blob_names = set()
+    created = []
+    for key, value in vars_.items():
+        if isinstance(value, dict) and _BLOB_KEY in value:
+            raise ValueError(f"variable '{key}' can't be stored: '{_BLOB_KEY}' is a reserved key")
+        data = value.encode() if isinstance(value, str) else value
+        if threshold is None or not isinstance(data, (bytes, bytearray)) or len(data) <= threshold:
+            stored_vars[key] = value
+            continue
+        blob_name = hashlib.sha256(data).hexdigest()
+        blob_path = os.path.join(blob_loc, blob_name)
+        if not os.path.exists(blob_path):
+            os.makedirs(blob_loc, exist_ok=True)
+            fd, tmp_path = _mkstemp(blob_path, suffix=".tmp")
+            with open(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, blob_path)
+            created.append(blob_path)
+        blob_names.add(blob_name)
+        stored_vars[key] = {_BLOB_KEY: blob_name}
+    return stored_vars, blob_names, created
+
+
+def _remove_stale_blobs(name, blob_names, settings):
+    """Remove the sidecar files for 'name' which are not in 'blob_names'.
+
+    Must be called while holding _storage_lock, so that leftover temporary
+    files are from interrupted writes and can be removed too. Readers which
+    loaded the removed files read the rewritten store instead (see _Blob).
+
+    Parameters
+    ----------
+    name: str
+        the name associated with the file storing the variables
+    blob_names: set
+        the names of the sidecar files referenced by the current file for 'name'
+    settings: mapping
+        a mapping containing the necessary settings
+    """
+    blob_loc = _get_blob_location(name, settings=settings)
+    try:
+        existing = os.listdir(blob_loc)
+    except FileNotFoundError:
+        return
+    stale = [blob_name for blob_name in existing if blob_name not in blob_names]
+    for blob_name in stale:
+        os.remove(os.path.join(blob_loc, blob_name))
+    if len(stale) == len(existing) and not blob_names:
+        os.rmdir(blob_loc)
+
+
+@contextlib.contextmanager
+def _storage_lock(settings):
+    """Hold an exclusive lock on settings["storage_dir"] (no-op where fcntl isn't available).
+
+    Yields wether the lock is held.
+
+    The lock is taken on the directory itself, so no lock file is created.
+    Writers must hold it from writing the sidecar files to removing the stale
+    ones: otherwise a writer could remove the sidecar files another writer is
+    about to publish.
+    """
+    if fcntl is None:
+        yield False
+        return
+    fd = os.open(settings["storage_dir"], os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield True
+    finally:
+        os.close(fd)  # releases the lock
+
+
+def _fsync_dir(path):
+    """Flush the directory entries of 'path' to disk (no-op where directories can't be opened)."""
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _mkstemp(path, suffix):
+    """Create a unique temporary file next to 'path' and return (fd, tmp_path) like tempfile.mkstemp.
+
+    tempfile.mkstemp creates files readable by their owner only: the temporary
+    file gets the mode of the file at 'path' instead, or the default mode for
+    new files (0o666 minus the umask) if 'path' doesn't exist.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=suffix,
+                                    dir=os.path.dirname(path))
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)  # the only way to read the umask is to set it
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    if hasattr(os, "fchmod"):  # not available on Windows
+        os.fchmod(fd, mode)
+    return fd, tmp_path
+
+
+def _remove_leftovers(path):
+    """Remove the temporary and backup files of 'path' left by interrupted writes (see _mkstemp and _publish).
+
+    Must be called while holding _storage_lock, so that no other writer is using them.
+    """
+    # tempfile.mkstemp's random part is 8 characters long
+    leftover = re.compile(re.escape(os.path.basename(path)) + r"\.\w{8}\.tmp(\.bak)?")
+    store_dir = os.path.dirname(path)
+    for file_name in os.listdir(store_dir):
+        if leftover.fullmatch(file_name):
+            _remove_if_exists(os.path.join(store_dir, file_name))
+
+
+def _remove_if_exists(path):
+    """Remove the file at 'path' if it exists."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _publish(staged):
+    """Rename every staged file over its store file, restoring the previous files on failure.
+
+    Parameters
+    ----------
+    staged: list
+        a list of (store_loc, tmp_loc) tuples, where tmp_loc is the path
+        of the file to rename to store_loc
+    """
+    published = []  # (store_loc, backup_loc) tuples, backup_loc is None if store_loc didn't exist
+    try:
+        for store_loc, tmp_loc in staged:
+            backup_loc = tmp_loc + ".bak"
+            try:
+                os.link(store_loc, backup_loc)
+            except FileNotFoundError:
+                backup_loc = None
+            except OSError:  # hard links not supported by the file system
+                try:
+                    shutil.copy2(store_loc, backup_loc)
+                except FileNotFoundError:
+                    backup_loc = None
+            try:
+                os.replace(tmp_loc, store_loc)  # NOTE: overwrites file
+            except BaseException:
+                if backup_loc is not None:
+                    os.remove(backup_loc)
+                raise
+            published.append((store_loc, backup_loc))
+    except BaseException:
+        for store_loc, backup_loc in reversed(published):
+            if backup_loc is None:
+                os.remove(store_loc)
+            else:
+                os.replace(backup_loc, store_loc)
+        raise
+    for _, backup_loc in published:
+        if backup_loc is not None:
+            os.remove(backup_loc)
+
+
+def _store_many_vars(vars_by_name, settings):
+    """Store the variables of every name in 'vars_by_name' as one batch.
+
+    Every file is first written under a unique temporary name and flushed
+    to disk, then all of them are renamed over the previous files, and each
+    storage directory is flushed once. Readers see either the old or the new
+    contents of each file, never a partially written one. For N names in one
+    directory, this costs N + 1 fsyncs instead of 2N for N calls to _store_vars.
+
+    NOTES
+    -----
+    This is not a transaction across names: readers loading several names
+    while the files are renamed may see some names updated and others not.
+    If an exception is raised, the files which were already renamed are
+    restored and the temporary files and new sidecar files are removed before
+    it is propagated. A crash while the files are renamed can leave some names
+    updated and others not, and its temporary files are removed by the next
+    call storing the same names.
+
+    Concurrent calls for the same storage directory are serialized (see
+    _storage_lock), so that a call never removes the sidecar files of another.
+
+    Parameters
+    ----------
+    vars_by_name: mapping
+        a mapping of names to dictionaries of variables (see _store_vars)
+    settings: mapping
+        a mapping containing the necessary settings
+    """
+    os.makedirs(settings["storage_dir"], exist_ok=True)
+    with _storage_lock(settings) as locked:
+        staged = []  # (name, store_loc, tmp_loc, blob_names) tuples
+        created_blobs = []
+        try:
+            for name, vars_ in vars_by_name.items():
+                store_loc = _get_storage_location(name, settings=settings)
+                stored_vars, blob_names, created = _store_blobs(name, vars_, settings=settings)
+                created_blobs.extend(created)
+                if locked:
+                    _remove_leftovers(store_loc)
+                fd, tmp_loc = _mkstemp(store_loc, suffix=".tmp")
+                staged.append((name, store_loc, tmp_loc, blob_names))
+                with open(fd, "w") as f:
+                    json.dump(stored_vars, f)
+            for _, _, tmp_loc, _ in staged:
+                with open(tmp_loc, "rb") as f:
+                    os.fsync(f.fileno())
+            _publish([(store_loc, tmp_loc) for _, store_loc, tmp_loc, _ in staged])
+        except BaseException:
+            for _, _, tmp_loc, _ in staged:
+                _remove_if_exists(tmp_loc)
+            for blob_path in created_blobs:
+                _remove_if_exists(blob_path)
+            raise
+
+        for store_dir in {os.path.dirname(store_loc) for _, store_loc, _, _ in staged}:
+            _fsync_dir(store_dir)
+        for name, _, _, blob_names in staged:
+            _remove_stale_blobs(name, blob_names, settings=settings)
+
+
 def _store_vars(name, vars_, settings):
     """Store 'vars_' in the file for 'name'.
 
+    If settings["blob_threshold"] is set, str and bytes values whose size
+    exceeds it (in bytes) are stored in sidecar files in settings["blob_dir"]
+    and loaded back as read-only memoryviews. str values are stored UTF-8
+    encoded: they are loaded back as memoryviews of the encoded bytes, which
+    don't compare equal to the original str.
+
     Parameters
     ----------
     name: str
         the name associated with the file storing the variables
     vars_: dict
-        a dictionary of json-encodable key/value pairs to store
+        a dictionary of json-encodable key/value pairs to store (bytes
+        values are allowed if they are stored in sidecar files)
     settings: mapping
         a mapping containing the necessary settings
     """
-    store_loc = _get_storage_location(name, settings=settings)
-    os.makedirs(settings["storage_dir"], exist_ok=True)
-    with open(store_loc, "w") as f:  # NOTE: overwrites file
-        json.dump(vars_, f)
+    _store_many_vars({name: vars_}, settings=settings)
+
+
+def _is_blob_reference(value):
+    """Return wether 'value' is a sidecar file reference as written by _store_blobs.
+
+    Examples
+    --------
+    >>> _is_blob_reference({_BLOB_KEY: "0" * 64})
+    True
+    >>> _is_blob_reference({_BLOB_KEY: "/etc/passwd"})
+    False
+    >>> _is_blob_reference({_BLOB_KEY: "0" * 64, "OTHER_KEY": 1})
+    False
+    """
+    return (isinstance(value, dict) and len(value) == 1 and isinstance(value.get(_BLOB_KEY), str)
+            and _BLOB_NAME.fullmatch(value[_BLOB_KEY]) is not None)
+
+
+def _decode_blobs(name, vars_, settings):
+    """Replace the sidecar file references in 'vars_' by _Blob objects (in place).
+
+    Only references as written by _store_blobs are replaced (see _is_blob_reference),
+    other dicts are left untouched. The sidecar files are not opened.
+
+    Parameters
+    ----------
+    name: str
+        the name associated with the file storing the variables
+    vars_: dict
+        the variables as decoded from the file for 'name'
+    settings: mapping
+        a mapping containing the necessary settings
+
+    Returns
+    -------
+    vars_: dict
+        the same dict, for convenience
+    """
+    blob_loc = None
+    for key, value in vars_.items():
+        if _is_blob_reference(value):
+            if blob_loc is None:
+                blob_loc = _get_blob_location(name, settings=settings)
+            vars_[key] = _Blob(os.path.join(blob_loc, value[_BLOB_KEY]), name, key, settings)
+    return vars_
+
+
+def _interned(value):
+    """Return 'value' interned if it is a str, or with its str items interned (in place) if it is a list.
+
+    Nested dicts are not traversed: they were already built by _interned_dict.
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        value[:] = map(_interned, value)
+    return value
+
+
+def _interned_dict(pairs):
+    """Return a dict of 'pairs' where keys and str values are interned (json object_pairs_hook).
+
+    str items of list values (nested lists included) are interned too.
+
+    Examples
+    --------
+    >>> a = _interned_dict([("KEY", "".join(["val", "ue"]))])
+    >>> b = _interned_dict([("KEY", "".join(["va", "lue"]))])
+    >>> a["KEY"] is b["KEY"]
+    True
+    >>> a = _interned_dict([("KEY", [["".join(["val", "ue"])]])])
+    >>> b = _interned_dict([("KEY", [["".join(["va", "lue"])]])])
+    >>> a["KEY"][0][0] is b["KEY"][0][0]
+    True
+    """
+    return {sys.intern(k): _interned(v) for k, v in pairs}
+
+
+def _referenced_objects(vars_):
+    """Return the objects referenced by 'vars_' as a dict mapping their ids to them.
+
+    Nested dicts and lists are traversed. The memory mapped by sidecar values
+    is not part of the python heap and isn't included.
+
+    Parameters
+    ----------
+    vars_: .storage._AttrFrozenDict or .storage._LazyAttrFrozenDict
+        the variables to traverse (lazily loaded variables which weren't
+        loaded yet reference no objects)
+    """
+    if isinstance(vars_, _LazyAttrFrozenDict):
+        if vars_._vars is None:
+            return {}
+        vars_ = vars_._vars
+    objects = {}
+    stack = [vars_._data]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in objects:
+            continue
+        objects[id(obj)] = obj
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, list):
+            stack.extend(obj)
+    return objects
 
 
 def _load_vars(name, settings):
@@ -200,11 +802,18 @@ def _load_vars(name, settings):
     Returns
     -------
     vars_: .storage._AttrFrozenDict
-        the retrieved variables as an _AttrFrozenDict instance
+        the retrieved variables as an _AttrFrozenDict instance (if
+        settings["dedup"] is True, keys and str values, including the items
+        of lists, are interned so that they are shared with the variables of
+        other names)
     """
     store_loc = _get_storage_location(name, settings=settings)
     try:
         with open(store_loc, "r") as f:
-            return _AttrFrozenDict(json.load(f))
+            hook = _interned_dict if settings.get("dedup") else None
+            vars_ = json.load(f, object_pairs_hook=hook)
     except FileNotFoundError:
         raise NameNotFound(f"name '{name}' not found") from None
+    vars_ = _AttrFrozenDict(_decode_blobs(name, vars_, settings=settings))
+    _loaded_vars[name] = vars_
+    return vars_
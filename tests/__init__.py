@@ -1,2 +1,2 @@
 from .test_storage import TestStorageFuncs, Test_AttrFrozenDict
-from .test_api import TestLoad
+from .test_api import TestLoad, TestStoreMany, TestMemoryReport
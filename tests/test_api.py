@@ -1,8 +1,12 @@
 """Tests for the 'load' module."""
+import gc
 import json
+import os
 import secrets
+import sys
 import tempfile
 import unittest
+import unittest.mock
 
 import configvars.api  # the module we are testing
 import configvars.storage
@@ -78,3 +82,270 @@ class TestLoad(unittest.TestCase):
                                  settings=self.SETTINGS)
             class _:
                 pass
+
+    def test_load_lazy_return(self):
+        """Test that 'load' returns lazily loaded values when 'lazy' is True and 'vars_' is None."""
+        lazy_vars = configvars.api.load(self.PROJECT_NAME, settings=self.SETTINGS, lazy=True)
+        self.assertFalse(hasattr(lazy_vars, "__deepcopy__"))  # dunder lookups don't load the variables
+        self.assertIsNone(lazy_vars._vars)
+        self.assertEqual(lazy_vars["SECRET_KEY"], self.SAMPLE_VARS["SECRET_KEY"])
+        self.assertEqual(lazy_vars, self.SAMPLE_VARS)
+
+    def test_load_lazy_eq(self):
+        """Test that lazily loaded values compare equal to eagerly loaded ones, in both orders."""
+        lazy_vars = configvars.api.load(self.PROJECT_NAME, settings=self.SETTINGS, lazy=True)
+        vars_ = configvars.api.load(self.PROJECT_NAME, settings=self.SETTINGS)
+        self.assertEqual(lazy_vars, vars_)
+        self.assertEqual(vars_, lazy_vars)
+
+    def test_load_lazy_name_not_found(self):
+        """Test that lazily loaded values raise NameNotFound on first access, not on 'load'."""
+        lazy_vars = configvars.api.load(secrets.token_hex(), settings=self.SETTINGS, lazy=True)
+        with self.assertRaises(configvars.storage.NameNotFound):
+            lazy_vars.SECRET_KEY
+
+        @configvars.api.load(secrets.token_hex(), list(self.SAMPLE_VARS), settings=self.SETTINGS, lazy=True)
+        class TestLoadMissing:
+            pass
+        with self.assertRaises(configvars.storage.NameNotFound):
+            TestLoadMissing.SECRET_KEY
+
+    def test_load_lazy_decorator(self):
+        """Test that 'load' doesn't read the file when decorating a class if 'lazy' is True."""
+        name = secrets.token_hex()
+
+        @configvars.api.load(name, list(self.SAMPLE_VARS), settings=self.SETTINGS, lazy=True)
+        class TestLoadLazy:
+            pass
+        # the file is created after the class is decorated
+        configvars.storage._store_vars(name, self.SAMPLE_VARS, settings=self.SETTINGS)
+        for var in self.SAMPLE_VARS:
+            self.assertEqual(getattr(TestLoadLazy, var), self.SAMPLE_VARS[var])
+            self.assertEqual(TestLoadLazy.__dict__[var], self.SAMPLE_VARS[var])  # the descriptor was replaced
+
+    def test_load_lazy_exception(self):
+        """Test that lazily loaded class attributes raise VarNotFound on first access."""
+        @configvars.api.load(self.PROJECT_NAME, ["VAR_NOT_AVAILABLE"], settings=self.SETTINGS, lazy=True)
+        class _:
+            pass
+        with self.assertRaises(configvars.storage.VarNotFound):
+            _.VAR_NOT_AVAILABLE
+
+    def test_load_lazy_all(self):
+        """Test that 'load' raises ValueError when 'lazy' is True and 'vars_' is "all" or True."""
+        for vars_ in ("all", True):
+            with self.assertRaises(ValueError):
+                configvars.api.load(self.PROJECT_NAME, vars_=vars_, settings=self.SETTINGS, lazy=True)
+
+    def test_validate(self):
+        """Test that 'validate' forces the loading of lazily loaded values."""
+        lazy_vars = configvars.api.load(self.PROJECT_NAME, settings=self.SETTINGS, lazy=True)
+        configvars.api.validate(lazy_vars)
+        self.assertEqual(lazy_vars._vars, self.SAMPLE_VARS)
+
+        missing_vars = configvars.api.load(secrets.token_hex(), settings=self.SETTINGS, lazy=True)
+        with self.assertRaises(configvars.storage.NameNotFound):
+            configvars.api.validate(missing_vars)
+
+        @configvars.api.load(self.PROJECT_NAME, list(self.SAMPLE_VARS) + ["VAR_NOT_AVAILABLE"],
+                             settings=self.SETTINGS, lazy=True)
+        class TestValidate:
+            pass
+        with self.assertRaises(configvars.storage.VarNotFound):
+            configvars.api.validate(TestValidate)
+
+    def test_validate_subclass(self):
+        """Test that 'validate' loads the variables of the decorated classes a class inherits from."""
+        @configvars.api.load(self.PROJECT_NAME, ["SECRET_KEY", "VAR_NOT_AVAILABLE"],
+                             settings=self.SETTINGS, lazy=True)
+        class TestValidate:
+            pass
+
+        class TestValidateSubclass(TestValidate):
+            VAR_NOT_AVAILABLE = None
+
+        with self.assertRaises(configvars.storage.VarNotFound):
+            configvars.api.validate(TestValidateSubclass)
+        self.assertEqual(TestValidate.__dict__["SECRET_KEY"], self.SAMPLE_VARS["SECRET_KEY"])
+
+
+class TestStoreMany(unittest.TestCase):
+    """Test the 'store_many' function of the 'load' module."""
+
+    PROJECT_NAMES = ["<test_project_name.one>", "<test_project_name.two>"]
+
+    def setUp(self):
+        """Set up self.
+
+        Create a temporary directory and a settings dict pointing to the temporary directory's name.
+        """
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.SETTINGS = {
+            "storage_dir": self.temp_dir.name,
+            "file_name": "{name}.test",
+        }
+
+    def tearDown(self):
+        """Tear down self.
+
+        Delete the temporary directory.
+        """
+        self.temp_dir.cleanup()
+
+    def test_store_many(self):
+        """Test that 'store_many' stores the variables of every name."""
+        vars_by_name = {name: {"SECRET_KEY": secrets.token_hex()} for name in self.PROJECT_NAMES}
+        configvars.api.store_many(vars_by_name, settings=self.SETTINGS)
+        for name, vars_ in vars_by_name.items():
+            self.assertEqual(configvars.api.load(name, settings=self.SETTINGS), vars_)
+        self.assertEqual(len(os.listdir(self.temp_dir.name)), len(self.PROJECT_NAMES))
+
+    def test_store_many_failure(self):
+        """Test that 'store_many' leaves every file untouched if one of them can't be written."""
+        old_vars = {"SECRET_KEY": secrets.token_hex()}
+        configvars.api.store_many({self.PROJECT_NAMES[0]: old_vars}, settings=self.SETTINGS)
+        with self.assertRaises(TypeError):
+            configvars.api.store_many({self.PROJECT_NAMES[0]: {"SECRET_KEY": secrets.token_hex()},
+                                       self.PROJECT_NAMES[1]: {"NOT_JSON": object()}},
+                                      settings=self.SETTINGS)
+        self.assertEqual(configvars.api.load(self.PROJECT_NAMES[0], settings=self.SETTINGS), old_vars)
+        self.assertEqual(len(os.listdir(self.temp_dir.name)), 1)
+
+    def test_store_many_publish_failure(self):
+        """Test that 'store_many' restores the files already replaced if replacing another one fails."""
+        old_vars = {"SECRET_KEY": secrets.token_hex()}
+        configvars.api.store_many({self.PROJECT_NAMES[0]: old_vars}, settings=self.SETTINGS)
+        os.mkdir(configvars.storage._get_storage_location(self.PROJECT_NAMES[1], settings=self.SETTINGS))
+        new_vars_by_name = {name: {"SECRET_KEY": secrets.token_hex()} for name in self.PROJECT_NAMES}
+        with self.assertRaises(OSError):
+            configvars.api.store_many(new_vars_by_name, settings=self.SETTINGS)
+        self.assertEqual(configvars.api.load(self.PROJECT_NAMES[0], settings=self.SETTINGS), old_vars)
+        self.assertEqual(len(os.listdir(self.temp_dir.name)), 2)
+
+    def test_store_many_mode(self):
+        """Test that 'store_many' keeps the mode of existing files and uses the umask for new ones."""
+        store_loc = configvars.storage._get_storage_location(self.PROJECT_NAMES[0], settings=self.SETTINGS)
+        umask = os.umask(0o022)
+        try:
+            configvars.api.store_many({self.PROJECT_NAMES[0]: {}}, settings=self.SETTINGS)
+            self.assertEqual(os.stat(store_loc).st_mode & 0o777, 0o644)
+            os.chmod(store_loc, 0o640)
+            configvars.api.store_many({self.PROJECT_NAMES[0]: {}}, settings=self.SETTINGS)
+            self.assertEqual(os.stat(store_loc).st_mode & 0o777, 0o640)
+        finally:
+            os.umask(umask)
+
+    def test_store_many_without_hard_links(self):
+        """Test that 'store_many' works on file systems which don't support hard links."""
+        configvars.api.store_many({self.PROJECT_NAMES[0]: {}}, settings=self.SETTINGS)
+        new_vars = {"SECRET_KEY": secrets.token_hex()}
+        with unittest.mock.patch("os.link", side_effect=PermissionError):
+            configvars.api.store_many({self.PROJECT_NAMES[0]: new_vars}, settings=self.SETTINGS)
+        self.assertEqual(configvars.api.load(self.PROJECT_NAMES[0], settings=self.SETTINGS), new_vars)
+        self.assertEqual(len(os.listdir(self.temp_dir.name)), 1)
+
+    @unittest.skipIf(configvars.storage.fcntl is None, "leftovers are only removed if fcntl is available")
+    def test_store_many_leftovers(self):
+        """Test that 'store_many' removes the temporary files left by interrupted calls."""
+        store_loc = configvars.storage._get_storage_location(self.PROJECT_NAMES[0], settings=self.SETTINGS)
+        for suffix in (".tmp", ".tmp.bak"):
+            with open(store_loc + ".abcd1234" + suffix, "w"):
+                pass
+        configvars.api.store_many({self.PROJECT_NAMES[0]: {}}, settings=self.SETTINGS)
+        self.assertEqual(os.listdir(self.temp_dir.name), [os.path.basename(store_loc)])
+
+    def test_store_many_failure_blobs(self):
+        """Test that 'store_many' removes the sidecar files it created if storing fails."""
+        settings = dict(self.SETTINGS, blob_threshold=64)
+        with self.assertRaises(TypeError):
+            configvars.api.store_many({self.PROJECT_NAMES[0]: {"BLOB": secrets.token_bytes(128)},
+                                       self.PROJECT_NAMES[1]: {"NOT_JSON": object()}},
+                                      settings=settings)
+        blob_loc = configvars.storage._get_blob_location(self.PROJECT_NAMES[0], settings=settings)
+        self.assertEqual(os.listdir(blob_loc), [])
+
+
+class TestMemoryReport(unittest.TestCase):
+    """Test the 'memory_report' function and the 'dedup' setting."""
+
+    PROJECT_NAMES = ["<test_project_name.one>", "<test_project_name.two>"]
+    SAMPLE_VARS = {
+        "SECRET_KEY": secrets.token_hex(),
+        "MAIL_USERNAME": "user@example.com",
+        "HOSTS": [secrets.token_hex()],
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up cls.
+
+        Create a temporary directory and a settings dict pointing to the temporary directory's name.
+        Store cls.SAMPLE_VARS for every name in cls.PROJECT_NAMES.
+        """
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.SETTINGS = {
+            "storage_dir": cls.temp_dir.name,
+            "file_name": "{name}.test",
+        }
+        configvars.api.store_many({name: cls.SAMPLE_VARS for name in cls.PROJECT_NAMES},
+                                  settings=cls.SETTINGS)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Tear down cls.
+
+        Delete the temporary directory.
+        """
+        cls.temp_dir.cleanup()
+
+    def test_dedup(self):
+        """Test that keys and str values are shared across names when 'dedup' is True."""
+        settings = dict(self.SETTINGS, dedup=True)
+        vars_1, vars_2 = (configvars.api.load(name, settings=settings) for name in self.PROJECT_NAMES)
+        self.assertEqual(vars_1, self.SAMPLE_VARS)
+        self.assertIs(vars_1.SECRET_KEY, vars_2.SECRET_KEY)
+        self.assertIs(next(iter(vars_1)), next(iter(vars_2)))
+        self.assertIs(vars_1.HOSTS[0], vars_2.HOSTS[0])
+
+    def test_memory_report(self):
+        """Test that 'memory_report' reports the bytes shared between names regardless of their order."""
+        settings = dict(self.SETTINGS, dedup=True)
+        vars_by_name = {name: configvars.api.load(name, settings=settings) for name in self.PROJECT_NAMES}
+        report = configvars.api.memory_report(vars_by_name)
+        usage_1, usage_2 = (report[name] for name in self.PROJECT_NAMES)
+        self.assertEqual(usage_1, usage_2)
+        self.assertLess(usage_1.unique, usage_1.total)
+
+        # without deduplication, the same variables use as much memory but share less of it
+        vars_by_name = {name: configvars.api.load(name, settings=self.SETTINGS)
+                        for name in self.PROJECT_NAMES}
+        report = configvars.api.memory_report(vars_by_name)
+        self.assertEqual(report[self.PROJECT_NAMES[0]].total, usage_1.total)
+        self.assertGreater(report[self.PROJECT_NAMES[0]].unique, usage_1.unique)
+
+    def test_memory_report_loaded(self):
+        """Test that 'memory_report' reports the variables loaded by the process by default."""
+        vars_by_name = {name: configvars.api.load(name, settings=self.SETTINGS)
+                        for name in self.PROJECT_NAMES}
+        report, expected_report = configvars.api.memory_report(), configvars.api.memory_report(vars_by_name)
+        for name in self.PROJECT_NAMES:
+            # other variables loaded by the process may share objects, so only totals are compared
+            self.assertEqual(report[name].total, expected_report[name].total)
+
+        del vars_by_name
+        gc.collect()
+        for name in self.PROJECT_NAMES:
+            self.assertNotIn(name, configvars.api.memory_report())
+
+    def test_memory_report_nested(self):
+        """Test that 'memory_report' counts the objects in nested values."""
+        value = secrets.token_hex(256)
+        vars_ = configvars.storage._AttrFrozenDict({"LIST": [value]})
+        report = configvars.api.memory_report({"nested": vars_})
+        self.assertGreater(report["nested"].total, sys.getsizeof(value))
+
+    def test_memory_report_lazy(self):
+        """Test that 'memory_report' doesn't load lazily loaded variables."""
+        lazy_vars = configvars.api.load(self.PROJECT_NAMES[0], settings=self.SETTINGS, lazy=True)
+        self.assertEqual(configvars.api.memory_report({"lazy": lazy_vars}), {"lazy": (0, 0)})
+        self.assertIsNone(lazy_vars._vars)
@@ -3,7 +3,9 @@ import json
 import os.path
 import secrets
 import tempfile
+import threading
 import unittest
+import unittest.mock
 
 import configvars.storage  # the module we are testing
 
@@ -72,6 +74,78 @@ class TestStorageFuncs(unittest.TestCase):
             vars_ = configvars.storage._load_vars(project_name, settings=self.SETTINGS)
             self.assertEqual(self.SAMPLE_VARS, vars_)
 
+    def test_store_blobs(self):
+        """Test that _store_vars moves large values to sidecar files and _load_vars maps them back."""
+        settings = dict(self.SETTINGS, blob_threshold=64)
+        big_str, big_bytes = secrets.token_hex(64), secrets.token_bytes(128)
+        sample_vars = dict(self.SAMPLE_VARS, BIG_STR=big_str, BIG_BYTES=big_bytes)
+        configvars.storage._store_vars("blobs", sample_vars, settings=settings)
+        blob_loc = configvars.storage._get_blob_location("blobs", settings=settings)
+        self.assertEqual(len(os.listdir(blob_loc)), 2)
+
+        vars_ = configvars.storage._load_vars("blobs", settings=settings)
+        self.assertEqual(vars_, dict(sample_vars, BIG_STR=big_str.encode()))
+        self.assertNotEqual(vars_, sample_vars)  # str values are loaded back as memoryviews
+        self.assertIsInstance(vars_.BIG_BYTES, memoryview)
+        self.assertEqual(vars_["BIG_BYTES"], big_bytes)
+        self.assertNotEqual(vars_.BIG_STR, big_str)
+        self.assertEqual(bytes(vars_.BIG_STR).decode(), big_str)
+        self.assertEqual(vars_.SECRET_KEY, self.SAMPLE_VARS["SECRET_KEY"])
+
+        # rewriting the store removes the sidecar files which are no longer referenced
+        configvars.storage._store_vars("blobs", dict(sample_vars, BIG_STR=""), settings=settings)
+        self.assertEqual(len(os.listdir(blob_loc)), 1)
+        configvars.storage._store_vars("blobs", self.SAMPLE_VARS, settings=settings)
+        self.assertFalse(os.path.exists(blob_loc))
+
+    def test_load_blobs_after_rewrite(self):
+        """Test that sidecar values removed by a rewrite before their first access are read again."""
+        settings = dict(self.SETTINGS, blob_threshold=64)
+        configvars.storage._store_vars("rewritten_blobs", {"X": b"A" * 100}, settings=settings)
+        vars_ = configvars.storage._load_vars("rewritten_blobs", settings=settings)
+        mapped_vars = configvars.storage._load_vars("rewritten_blobs", settings=settings)
+        self.assertEqual(mapped_vars.X, b"A" * 100)
+        configvars.storage._store_vars("rewritten_blobs", {"X": b"B" * 100}, settings=settings)
+        self.assertEqual(vars_.X, b"B" * 100)
+        self.assertEqual(mapped_vars.X, b"A" * 100)  # already mapped values stay readable
+
+    @unittest.skipIf(configvars.storage.fcntl is None, "writers are only serialized where fcntl is available")
+    def test_store_blobs_concurrent_writers(self):
+        """Test that a writer can't remove the sidecar files another writer is about to publish."""
+        settings = dict(self.SETTINGS, blob_threshold=64)
+        publish = configvars.storage._publish
+        writer = threading.Thread(target=configvars.storage._store_vars,
+                                  args=("concurrent_blobs", {"X": b"B" * 100}), kwargs={"settings": settings})
+
+        def publish_during_write(staged):
+            if threading.current_thread() is writer:
+                return publish(staged)
+            writer.start()
+            writer.join(timeout=0.2)
+            self.assertTrue(writer.is_alive())  # the other writer waits for this one to finish
+            publish(staged)
+
+        with unittest.mock.patch.object(configvars.storage, "_publish", side_effect=publish_during_write):
+            configvars.storage._store_vars("concurrent_blobs", {"X": b"A" * 100}, settings=settings)
+        self.assertEqual(configvars.storage._load_vars("concurrent_blobs", settings=settings).X, b"A" * 100)
+        writer.join()
+        self.assertEqual(configvars.storage._load_vars("concurrent_blobs", settings=settings).X, b"B" * 100)
+        blob_loc = configvars.storage._get_blob_location("concurrent_blobs", settings=settings)
+        self.assertEqual(len(os.listdir(blob_loc)), 1)
+
+    def test_blob_references(self):
+        """Test that only sidecar file references written by _store_vars are decoded."""
+        with self.assertRaises(ValueError):
+            configvars.storage._store_vars("blob_references", {"CFG": {"__configvars_blob__": "x"}},
+                                           settings=self.SETTINGS)
+        store_loc = configvars.storage._get_storage_location("blob_references", settings=self.SETTINGS)
+        sample_vars = {"ABSOLUTE": {"__configvars_blob__": os.path.abspath(store_loc)},
+                       "RELATIVE": {"__configvars_blob__": os.path.join("..", "secret")}}
+        with open(store_loc, "w") as f:
+            json.dump(sample_vars, f)
+        vars_ = configvars.storage._load_vars("blob_references", settings=self.SETTINGS)
+        self.assertEqual(vars_, sample_vars)
+
 
 class Test_AttrFrozenDict(unittest.TestCase):
     """Class responsible for testing the _AttrFrozenDict of the 'storage' module."""